@@ -1,102 +1,128 @@
 """Batch generate episodes for the Wunderbots library.
 Run from Nash with: python3 generate_library.py
 
-Generates episode JSON + TTS audio for each scene, saves to library/.
-The resulting JSON files ship with the repo — zero API calls on replay.
+Generates episode JSON + TTS audio for each scene, saves to library/
+(<slug>.json plus one <slug>/<scene_key>.mp3 per scene).
+The resulting files ship with the repo — zero API calls on replay.
 """
-import os, sys, json, re, time, base64
+import os, re, time, shutil, asyncio, argparse
 
+from ratelimit import ELEVENLABS, is_rate_limit
+from http_pool import HTTP, close_http
 from prompts import STAGE_1_SYSTEM as STAGE1_SYSTEM, STAGE_1_USER as STAGE1_USER, STAGE_2_SYSTEM as STAGE2_SYSTEM, STAGE_2_USER as STAGE2_USER
-from tts import build_expert_voice_map, generate_speech, EMOTION_DIRECTIONS
-from openai import OpenAI
+import httpx
+import orjson
+from openai import AsyncOpenAI
 
-client = OpenAI(
+client = AsyncOpenAI(
     api_key=os.environ.get("GROK_API_KEY"),
-    base_url="https://api.groq.com/openai/v1"
+    base_url="https://api.groq.com/openai/v1",
+    http_client=HTTP,
+    timeout=httpx.Timeout(120.0, connect=5.0),
+    max_retries=3,
 )
 MODEL = os.environ.get("WUNDERBOTS_MODEL", "openai/gpt-oss-120b")
+# Episodes generated at once — keep under the Groq RPM tier (2 calls each)
+CONCURRENCY = int(os.environ.get("WUNDERBOTS_CONCURRENCY", "3"))
 LIBRARY_DIR = os.path.join(os.path.dirname(__file__), "library")
+# Built once — constant system prompts keep a shared, cacheable prefix
+STAGE1_SYSTEM_MSG = {"role": "system", "content": STAGE1_SYSTEM}
+STAGE2_SYSTEM_MSG = {"role": "system", "content": STAGE2_SYSTEM}
+# Groq JSON mode — replies are one bare JSON object, parsed directly
+JSON_OBJECT = {"type": "json_object"}
 os.makedirs(LIBRARY_DIR, exist_ok=True)
 
+_RE_NONWORD = re.compile(r'[^\w\s-]')
+_RE_DASHES = re.compile(r'[\s_-]+')
+
 def slugify(text):
-    t = text.lower().strip()
-    t = re.sub(r'[^\w\s-]', '', t)
-    t = re.sub(r'[\s_-]+', '-', t)
-    return t[:60].strip('-')
+    return _RE_DASHES.sub('-', _RE_NONWORD.sub('', text.lower().strip()))[:60].strip('-')
+
+def write_episode(episode, path, option=0):
+    """Write episode JSON atomically — a crash mid-write never truncates it.
+    Also writes the small <slug>.meta.json sidecar the library listing reads."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(episode, option=option))
+    os.replace(tmp, path)
+    meta = {
+        "question": episode.get("question", "Unknown"),
+        "answer_summary": episode.get("answer_summary", ""),
+    }
+    with open(path[:-len(".json")] + ".meta.json", "wb") as f:
+        f.write(orjson.dumps(meta))
 
-def generate_episode_json(question):
-    """Run the 2-stage prompt chain to generate episode JSON."""
+async def generate_episode_json(question, save=True):
+    """Run the 2-stage prompt chain to generate episode JSON.
+
+    With save=False the episode is only returned, so the caller can write
+    it once after audio is added.
+    """
     slug = slugify(question)
     path = os.path.join(LIBRARY_DIR, f"{slug}.json")
     
     # Check if JSON already exists (without audio)
     if os.path.exists(path):
-        with open(path) as f:
-            ep = json.load(f)
+        with open(path, "rb") as f:
+            ep = orjson.loads(f.read())
         if ep.get("acts"):
             print(f"  📄 JSON exists: {slug}")
             return ep, slug, path
     
     # Stage 1: Research & Outline
-    print(f"  📝 Stage 1: Research & Outline...")
+    print(f"  📝 [{slug}] Stage 1: Research & Outline...")
     t0 = time.time()
-    r1 = client.chat.completions.create(
+    r1 = await client.chat.completions.create(
         model=MODEL,
         messages=[
-            {"role": "system", "content": STAGE1_SYSTEM},
+            STAGE1_SYSTEM_MSG,
             {"role": "user", "content": STAGE1_USER.format(question=question)},
         ],
         temperature=0.7,
         max_tokens=4096,
+        response_format=JSON_OBJECT,
     )
-    outline_text = r1.choices[0].message.content.strip()
-    if "```json" in outline_text:
-        outline_text = outline_text.split("```json")[1].split("```")[0].strip()
-    elif "```" in outline_text:
-        outline_text = outline_text.split("```")[1].split("```")[0].strip()
-    outline = json.loads(outline_text)
-    print(f"     Done ({time.time()-t0:.1f}s)")
+    outline = orjson.loads(r1.choices[0].message.content)
+    print(f"     [{slug}] Stage 1 done ({time.time()-t0:.1f}s)")
     
     # Stage 2: Script Generation
-    print(f"  🎬 Stage 2: Script Generation...")
+    print(f"  🎬 [{slug}] Stage 2: Script Generation...")
     t1 = time.time()
-    r2 = client.chat.completions.create(
+    r2 = await client.chat.completions.create(
         model=MODEL,
         messages=[
-            {"role": "system", "content": STAGE2_SYSTEM},
-            {"role": "user", "content": STAGE2_USER.format(outline=json.dumps(outline, indent=2))},
+            STAGE2_SYSTEM_MSG,
+            {"role": "user", "content": STAGE2_USER.format(outline=orjson.dumps(outline, option=orjson.OPT_INDENT_2).decode())},
         ],
         temperature=0.7,
         max_tokens=16384,
+        response_format=JSON_OBJECT,
     )
-    script_text = r2.choices[0].message.content.strip()
-    if "```json" in script_text:
-        script_text = script_text.split("```json")[1].split("```")[0].strip()
-    elif "```" in script_text:
-        script_text = script_text.split("```")[1].split("```")[0].strip()
-    episode = json.loads(script_text)
-    print(f"     Done ({time.time()-t1:.1f}s)")
-    
-    # Add voice map
-    episode["voice_map"] = build_expert_voice_map(episode.get("characters", {}))
-    
-    # Save JSON (without audio yet)
-    with open(path, "w") as f:
-        json.dump(episode, f, indent=2)
-    print(f"  💾 Saved: {path}")
+    episode = orjson.loads(r2.choices[0].message.content)
+    print(f"     [{slug}] Stage 2 done ({time.time()-t1:.1f}s)")
+    
+    if save:
+        write_episode(episode, path, orjson.OPT_INDENT_2)
+        print(f"  💾 Saved: {path}")
     
     return episode, slug, path
 
 
-def generate_audio_for_episode(episode, slug, path):
-    """Generate TTS audio for all dialogue scenes and embed in the JSON."""
-    voice_map = episode.get("voice_map", {})
-    audio_cache = episode.get("audio_cache", {})
+async def generate_audio_for_episode(episode, slug, path):
+    """Generate TTS audio for all dialogue scenes as library/<slug>/<scene_key>.mp3."""
+    from tts import generate_speech_file, generate_episode_audio, cached_speech_path, speech_cache_path, coalesce, make_renderer, build_expert_voice_map  # lazy: --text-only runs never load TTS
+    # Voice map is only needed for audio (the server builds one on load), so
+    # episodes saved by an earlier --text-only run get theirs here
+    episode.setdefault("voice_map", build_expert_voice_map(episode.get("characters", {})))
+    render = make_renderer(episode["voice_map"], "troy")
+    audio_cache = episode.get("audio_cache", {})  # legacy embedded audio
+    audio_dir = os.path.join(LIBRARY_DIR, slug)
     
+    # Scenes that still need audio; generate_episode_audio synthesizes a line
+    # repeated within the episode once and fans it out
+    jobs = {}
     total_scenes = 0
     cached_scenes = 0
-    generated_scenes = 0
-    
     for aI, act in enumerate(episode.get("acts", [])):
         for sI, scene in enumerate(act.get("scenes", [])):
             if scene.get("type") not in ("dialogue", "explanation"):
@@ -107,44 +133,89 @@ def generate_audio_for_episode(episode, slug, path):
             total_scenes += 1
             key = f"{aI}-{sI}"
             
-            if key in audio_cache:
+            if key in audio_cache or os.path.exists(os.path.join(audio_dir, f"{key}.mp3")):
                 cached_scenes += 1
                 continue
             
-            voice = voice_map.get(scene.get("character", ""), "troy")
-            emotion = scene.get("emotion", "neutral")
-            text = scene["text"]
-            
+            jobs[key] = render(scene)
+    
+    # Set once we hit a rate limit so queued jobs don't keep hammering the API
+    rate_limited = asyncio.Event()
+    
+    # Each line streams into the TTS disk cache and is copied out from there,
+    # so an episode's audio never has to fit in memory at once
+    async def one(text, voice, emotion, character):
+        # Disk-cache hits don't need an ElevenLabs rate-limit slot
+        audio_path = await asyncio.to_thread(cached_speech_path, text, voice, emotion)
+        if audio_path is not None or rate_limited.is_set():
+            return audio_path
+        
+        async def synthesize():
+            if rate_limited.is_set():
+                return None
             try:
-                audio_bytes = generate_speech(text, voice, emotion)
-                audio_cache[key] = base64.b64encode(audio_bytes).decode("ascii")
-                generated_scenes += 1
-                
-                # Rate limit — Groq free tier is tight
-                time.sleep(0.5)
-                
+                # Shared ElevenLabs profile: sliding-window RPM + backoff on 429s
+                return await ELEVENLABS.call(generate_speech_file, text, voice, emotion, character)
             except Exception as e:
-                print(f"    ⚠️  TTS failed for {key}: {e}")
-                # If we hit rate limits, stop TTS generation
-                if "rate" in str(e).lower() or "limit" in str(e).lower():
-                    print("    🛑 Rate limited — stopping TTS generation")
-                    break
-        else:
-            continue
-        break  # break outer loop if inner loop broke
-    
-    episode["audio_cache"] = audio_cache
-    
-    # Save updated JSON with audio
-    with open(path, "w") as f:
-        json.dump(episode, f)
-    
-    filesize = os.path.getsize(path)
-    print(f"  🔊 Audio: {generated_scenes} generated, {cached_scenes} cached, {total_scenes} total")
-    print(f"  📦 File size: {filesize / 1024:.0f} KB")
+                print(f"    ⚠️  [{slug}] TTS failed for '{text[:40]}': {e}")
+                # Still rate limited after the retries — stop TTS generation
+                if is_rate_limit(e):
+                    if not rate_limited.is_set():
+                        print(f"    🛑 [{slug}] Rate limited — stopping TTS generation")
+                    rate_limited.set()
+                return None
+        
+        # Another episode may be rendering the same line right now — share it
+        return await coalesce(speech_cache_path(text, voice, emotion), synthesize)
+    
+    results = await generate_episode_audio(jobs, synthesize=one)
+    
+    # One sidecar MP3 per scene — the episode JSON stays text-only
+    generated_scenes = 0
+    audio_bytes_total = 0
+    for key, audio_path in results.items():
+        if isinstance(audio_path, str):
+            os.makedirs(audio_dir, exist_ok=True)
+            shutil.copyfile(audio_path, os.path.join(audio_dir, f"{key}.mp3"))
+            audio_bytes_total += os.path.getsize(audio_path)
+            generated_scenes += 1
+    
+    write_episode(episode, path)
+    
+    print(f"  🔊 [{slug}] Audio: {generated_scenes} generated, {cached_scenes} cached, {total_scenes} total")
+    print(f"  📦 [{slug}] Audio written: {audio_bytes_total / 1024:.0f} KB")
     return generated_scenes
 
 
+async def process_question(question, sem, include_audio=True):
+    """Generate one episode (and optionally its audio), bounded by `sem`."""
+    async with sem:
+        print(f"📚 {question}")
+        try:
+            # With audio, the episode is written once after TTS instead of twice
+            ep, slug, path = await generate_episode_json(question, save=not include_audio)
+            scenes = sum(len(a['scenes']) for a in ep.get('acts', []))
+            print(f"  ✅ [{slug}] {scenes} scenes, {len(ep.get('characters', {}))} characters")
+
+            if include_audio:
+                print(f"  🎙️ [{slug}] Generating audio...")
+                await generate_audio_for_episode(ep, slug, path)
+        except Exception as e:
+            print(f"  ❌ [{question}] Error: {e}")
+            if include_audio:
+                import traceback; traceback.print_exc()
+
+
+async def run(questions, include_audio=True):
+    """Generate all episodes concurrently — each is independent network I/O."""
+    sem = asyncio.Semaphore(CONCURRENCY)
+    tasks = [process_question(q, sem, include_audio) for q in questions]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        await close_http()
+
+
 if __name__ == "__main__":
     QUESTIONS = [
         "Why is the sky blue?",
@@ -154,39 +225,22 @@ if __name__ == "__main__":
         "How do rainbows form?",
     ]
     
-    # Allow filtering from command line
-    if len(sys.argv) > 1:
-        if sys.argv[1] == "--text-only":
-            # Generate just the episode JSON, no audio
-            for q in QUESTIONS:
-                print(f"\n{'='*60}")
-                print(f"📚 {q}")
-                try:
-                    ep, slug, path = generate_episode_json(q)
-                    scenes = sum(len(a['scenes']) for a in ep.get('acts', []))
-                    print(f"  ✅ {scenes} scenes, {len(ep.get('characters', {}))} characters")
-                except Exception as e:
-                    print(f"  ❌ Error: {e}")
-            print(f"\n{'='*60}")
-            print("Done! Run without --text-only to add audio.")
-            sys.exit(0)
-        else:
-            QUESTIONS = [" ".join(sys.argv[1:])]
-    
-    for q in QUESTIONS:
-        print(f"\n{'='*60}")
-        print(f"📚 {q}")
-        try:
-            ep, slug, path = generate_episode_json(q)
-            scenes = sum(len(a['scenes']) for a in ep.get('acts', []))
-            print(f"  ✅ {scenes} scenes, {len(ep.get('characters', {}))} characters")
-            
-            print(f"  🎙️ Generating audio...")
-            generate_audio_for_episode(ep, slug, path)
-        except Exception as e:
-            print(f"  ❌ Error: {e}")
-            import traceback; traceback.print_exc()
+    parser = argparse.ArgumentParser(description="Batch generate episodes for the Wunderbots library.")
+    parser.add_argument("question", nargs="*", help="generate just this question instead of the default list")
+    parser.add_argument("--text-only", action="store_true", help="generate episode JSON only, no audio")
+    args = parser.parse_args()
+    
+    questions = [" ".join(args.question)] if args.question else QUESTIONS
+    include_audio = not args.text_only
+    
+    t0 = time.time()
+    asyncio.run(run(questions, include_audio))
     
     print(f"\n{'='*60}")
-    print("Library generation complete!")
-    print(f"Episodes in library: {len(os.listdir(LIBRARY_DIR))}")
+    if include_audio:
+        print(f"Library generation complete! ({time.time()-t0:.1f}s)")
+        episodes = sum(1 for name in os.listdir(LIBRARY_DIR)
+                       if name.endswith(".json") and not name.endswith(".meta.json"))
+        print(f"Episodes in library: {episodes}")
+    else:
+        print("Done! Run without --text-only to add audio.")
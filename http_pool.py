@@ -0,0 +1,25 @@
+"""Wunderbots outbound HTTP — one pooled client for every provider.
+
+Groq (through the OpenAI SDK) and ElevenLabs share a single HTTP/2
+httpx.AsyncClient, so TLS handshakes are paid once per host and concurrent
+requests multiplex over the kept-alive connections.
+
+The client carries no base_url or credentials: each caller sends full URLs
+and its own auth headers.
+"""
+import httpx
+
+LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=32)
+
+# retries= re-attempts only failed connects (refused, reset, DNS), so a POST
+# is never sent twice; 429s and 5xx are left to the callers' own policies.
+HTTP = httpx.AsyncClient(
+    transport=httpx.AsyncHTTPTransport(http2=True, limits=LIMITS, retries=3),
+    follow_redirects=True,
+    timeout=httpx.Timeout(120.0, connect=5.0),
+)
+
+
+async def close_http():
+    """Close the shared client (call once on shutdown)."""
+    await HTTP.aclose()
@@ -0,0 +1,161 @@
+"""Wunderbots rate limiting — keep provider calls under their RPM/TPM caps.
+
+Each provider gets a ProviderLimiter profile: a sliding 60s window of
+request + token counts, plus an AIMD concurrency cap. Every success nudges
+the cap up (additive increase); a 429 halves it (multiplicative decrease)
+and the call is retried after an exponential backoff. Profiles can also
+space out request starts (min_interval) so a burst doesn't land on the
+provider all at once, and retry timeouts / 5xx the same way as 429s.
+
+Usage:
+    result = await GROQ.call(some_coroutine_fn, *args, est_tokens=1200)
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+
+import httpx
+from contextlib import asynccontextmanager
+
+log = logging.getLogger("wunderbots.ratelimit")
+
+WINDOW = 60.0  # seconds — providers quote limits per minute
+
+
+def is_rate_limit(exc: Exception) -> bool:
+    """True if `exc` looks like a provider 429 (OpenAI SDK or our own errors)."""
+    if getattr(exc, "status_code", None) == 429:
+        return True
+    msg = str(exc).lower()
+    return "429" in msg or "rate limit" in msg
+
+
+def is_transient(exc: Exception) -> bool:
+    """True for failures worth retrying as-is: timeouts and 5xx gateway errors."""
+    if isinstance(exc, (httpx.TimeoutException, asyncio.TimeoutError)):
+        return True
+    if isinstance(exc.__cause__, httpx.TimeoutException):  # OpenAI SDK's APITimeoutError
+        return True
+    return getattr(exc, "status_code", None) in (500, 502, 503, 504)
+
+
+class ProviderLimiter:
+    """Sliding-window RPM/TPM limiter with an AIMD concurrency cap."""
+
+    def __init__(self, name: str, rpm: int, tpm: int = 0,
+                 max_concurrency: int = 8, max_attempts: int = 3,
+                 min_interval: float = 0.0, retry_transient: bool = False):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm  # 0 = don't track tokens
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.min_interval = min_interval  # seconds between request starts
+        self.retry_transient = retry_transient  # also retry timeouts / 5xx
+        self.limit = float(max_concurrency)
+        self._active = 0
+        self._last_start = float("-inf")
+        self._window: deque[tuple[float, int]] = deque()  # (started_at, tokens)
+        self._window_tokens = 0
+        self._cond = asyncio.Condition()
+
+    def _delay(self, now: float, tokens: int) -> float:
+        """Seconds until the window has room for one more request."""
+        while self._window and now - self._window[0][0] >= WINDOW:
+            self._window_tokens -= self._window.popleft()[1]
+        if not self._window:
+            return 0.0
+        full = len(self._window) >= self.rpm
+        if self.tpm and self._window_tokens + tokens > self.tpm:
+            full = True
+        return WINDOW - (now - self._window[0][0]) if full else 0.0
+
+    async def acquire(self, tokens: int = 0):
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: self._active < int(self.limit))
+                now = time.monotonic()
+                delay = max(self._delay(now, tokens),
+                            self._last_start + self.min_interval - now)
+                if delay <= 0:
+                    self._active += 1
+                    self._last_start = now
+                    self._window.append((now, tokens))
+                    self._window_tokens += tokens
+                    return
+            await asyncio.sleep(delay)
+
+    async def release(self):
+        async with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0):
+        await self.acquire(tokens)
+        try:
+            yield
+        finally:
+            await self.release()
+
+    async def call(self, fn, *args, est_tokens: int = 0, hold: bool = False, **kwargs):
+        """Await `fn(*args, **kwargs)` under this limiter, retrying 429s
+        (and timeouts / 5xx when retry_transient is set).
+
+        With hold=True the slot stays taken after a success — for results
+        that keep using the provider once `fn` returns, like a streaming
+        response. The caller must then `await release()` when done.
+        """
+        for attempt in range(self.max_attempts):
+            await self.acquire(est_tokens)
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                await self.release()
+                last = attempt == self.max_attempts - 1
+                if is_rate_limit(e) and not last:
+                    self.limit = max(1.0, self.limit / 2)
+                    log.warning(f"{self.name}: rate limited, concurrency → {int(self.limit)}, "
+                                f"retry {attempt + 1}/{self.max_attempts - 1}")
+                elif self.retry_transient and is_transient(e) and not last:
+                    log.warning(f"{self.name}: {type(e).__name__}: {e}, "
+                                f"retry {attempt + 1}/{self.max_attempts - 1}")
+                else:
+                    raise
+            except BaseException:
+                await self.release()
+                raise
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                if not hold:
+                    await self.release()
+                return result
+            await asyncio.sleep(2 ** attempt + random.random())
+
+
+# ─── Provider profiles ───────────────────────────────────────────────────────
+# Defaults match the free tiers; raise them via env on paid plans.
+
+# Clients called through GROQ must be built with max_retries=0: retries the
+# OpenAI SDK makes internally never reach the window or the AIMD cap.
+GROQ = ProviderLimiter(
+    "groq",
+    rpm=int(os.environ.get("GROQ_RPM", "30")),
+    tpm=int(os.environ.get("GROQ_TPM", "150000")),
+    max_concurrency=int(os.environ.get("GROQ_CONCURRENCY", "8")),
+    retry_transient=True,
+)
+
+# TTS providers are known to stall under bursts of parallel calls, so
+# ElevenLabs starts are spaced out and transient failures retried with jitter.
+ELEVENLABS = ProviderLimiter(
+    "elevenlabs",
+    rpm=int(os.environ.get("ELEVENLABS_RPM", "120")),
+    max_concurrency=int(os.environ.get("ELEVENLABS_CONCURRENCY", "4")),
+    max_attempts=4,
+    min_interval=float(os.environ.get("ELEVENLABS_MIN_INTERVAL", "0.05")),
+    retry_transient=True,
+)
@@ -1,113 +1,222 @@
 """Wunderbots server — Starlette + Groq"""
 import os
-import json
 import random
+import copy
 import time
+import asyncio
+import tempfile
 import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from starlette.applications import Starlette
-from starlette.responses import JSONResponse, FileResponse, Response
+from starlette.responses import JSONResponse, FileResponse, Response, StreamingResponse
 from starlette.routing import Route, Mount
 from starlette.staticfiles import StaticFiles
 from starlette.middleware.cors import CORSMiddleware
-from openai import OpenAI
+import httpx
+import orjson
+from openai import AsyncOpenAI
 from prompts import STAGE_1_SYSTEM, STAGE_1_USER, STAGE_2_SYSTEM, STAGE_2_USER
-from tts import build_expert_voice_map, generate_speech, NARRATOR_VOICE, PROCTOR_VOICE, EMOTION_DIRECTIONS
+from ratelimit import GROQ, ELEVENLABS
+from http_pool import HTTP, close_http
+from tts import ElevenLabsError, build_expert_voice_map, make_renderer, generate_speech, generate_episode_audio, open_speech_stream, cached_speech, store_speech, speech_cache_key, coalesce, join_inflight, start_inflight, finish_inflight, TTS_TIMEOUT, NARRATOR_VOICE, PROCTOR_VOICE, EMOTION_DIRECTIONS
 import re
 import glob
 
 LIBRARY_DIR = os.path.join(os.path.dirname(__file__), "library")
 os.makedirs(LIBRARY_DIR, exist_ok=True)
 
+_RE_NONWORD = re.compile(r'[^\w\s-]')
+_RE_DASHES = re.compile(r'[\s_-]+')
+
 def slugify(text):
     t = text.lower().strip()
-    t = re.sub(r'[^\w\s-]', '', t)
-    t = re.sub(r'[\s_-]+', '-', t)
+    t = _RE_NONWORD.sub('', t)
+    t = _RE_DASHES.sub('-', t)
     return t[:60].strip('-')
 
+def episode_meta(episode: dict) -> dict:
+    """The listing fields for one episode — all /api/library needs."""
+    return {
+        "question": episode.get("question", "Unknown"),
+        "answer_summary": episode.get("answer_summary", ""),
+    }
+
 def save_episode(episode):
-    """Save a generated episode to the library."""
-    question = episode.get("question", "unknown")
-    slug = slugify(question)
+    """Save a generated episode (plus its <slug>.meta.json listing sidecar) to the library."""
+    slug = episode.get("slug") or slugify(episode.get("question", "unknown"))
     path = os.path.join(LIBRARY_DIR, f"{slug}.json")
     # Don't overwrite existing episodes
     if not os.path.exists(path):
-        with open(path, "w") as f:
-            json.dump(episode, f)
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(episode))
+        with open(os.path.join(LIBRARY_DIR, f"{slug}.meta.json"), "wb") as f:
+            f.write(orjson.dumps(episode_meta(episode)))
+        LIBRARY[slug] = {k: v for k, v in episode.items() if k != "audio_cache"}
+        _lib_cache["mtime"] = 0
         log.info(f"Saved episode to library: {slug}")
     return slug
 
+def _read_episode(path: str) -> dict:
+    """Read and parse one library episode file (blocking — call via to_thread)."""
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
+
+# slug → episode, preloaded at startup so known questions skip the LLM.
+# Embedded audio_cache blobs stay on disk (served by api_library_audio).
+LIBRARY: dict[str, dict] = {}
+
+def preload_library():
+    """Load every library episode into LIBRARY."""
+    for path in glob.glob(os.path.join(LIBRARY_DIR, "*.json")):
+        if path.endswith(".meta.json"):
+            continue
+        slug = os.path.basename(path).replace(".json", "")
+        try:
+            ep = _read_episode(path)
+        except Exception as e:
+            log.error(f"Error preloading {path}: {e}")
+            continue
+        ep.pop("audio_cache", None)
+        LIBRARY[slug] = ep
+    log.info(f"Preloaded {len(LIBRARY)} library episodes")
+
+# Listing cache for /api/library, rebuilt when the library directory changes
+_lib_cache = {"mtime": 0, "episodes": [], "body": b'{"episodes":[]}'}
+
 def load_library():
-    """Load all episodes from the library directory."""
+    """List library episodes from their .meta.json sidecars (cached on the directory mtime).
+
+    Episodes without a sidecar (e.g. dropped in by hand) fall back to
+    parsing the full episode JSON.
+    """
+    mtime = os.stat(LIBRARY_DIR).st_mtime_ns
+    if mtime == _lib_cache["mtime"]:
+        return _lib_cache["episodes"]
+    with os.scandir(LIBRARY_DIR) as it:
+        names = {entry.name for entry in it if entry.is_file()}
     episodes = []
-    for path in sorted(glob.glob(os.path.join(LIBRARY_DIR, "*.json"))):
+    for name in sorted(names):
+        if not name.endswith(".json") or name.endswith(".meta.json"):
+            continue
+        slug = name[:-len(".json")]
+        meta_name = f"{slug}.meta.json"
         try:
-            with open(path) as f:
-                ep = json.load(f)
-            slug = os.path.basename(path).replace(".json", "")
-            episodes.append({
-                "slug": slug,
-                "question": ep.get("question", "Unknown"),
-                "answer_summary": ep.get("answer_summary", ""),
-            })
+            if meta_name in names:
+                meta = _read_episode(os.path.join(LIBRARY_DIR, meta_name))
+            else:
+                meta = episode_meta(_read_episode(os.path.join(LIBRARY_DIR, name)))
+            episodes.append({"slug": slug, **meta})
         except Exception as e:
-            log.error(f"Error loading {path}: {e}")
+            log.error(f"Error loading {name}: {e}")
+    _lib_cache.update(mtime=mtime, episodes=episodes, body=orjson.dumps({"episodes": episodes}))
     return episodes
 
+def library_listing_json() -> bytes:
+    """The /api/library response body, serialized once per library change."""
+    load_library()
+    return _lib_cache["body"]
+
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("wunderbots")
 
-client = OpenAI(
+# Groq calls ride the shared HTTP/2 pool (http_pool.HTTP) with ElevenLabs:
+# keep-alive skips the TLS handshake per request, and the timeout caps how
+# long a hung call can stall. Every call goes through GROQ.call, so the SDK's
+# own retries are off — the limiter alone retries, and counts every attempt.
+client = AsyncOpenAI(
     base_url="https://api.groq.com/openai/v1",
     api_key=os.environ.get("GROK_API_KEY"),
+    http_client=HTTP,
+    timeout=httpx.Timeout(120.0, connect=5.0),
+    max_retries=0,
 )
 MODEL = os.environ.get("WUNDERBOTS_MODEL", "openai/gpt-oss-120b")
 
-# In-memory TTS cache: episode_key → { "act-scene" → wav_bytes }
-tts_cache: dict[str, dict[str, bytes]] = {}
+class LRUCache:
+    """Dict-like cache that evicts the least recently used entry past maxsize."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+# In-memory TTS cache in front of the disk cache: speech_cache_key → mp3 bytes.
+# Bounded so a busy server's memory scales with the LRU size, not traffic.
+tts_cache = LRUCache(maxsize=int(os.environ.get("TTS_MEMORY_CACHE_SIZE", "256")))
+
 
+# System prompts are constant and always first, so every request shares the
+# same prefix — which Groq's automatic prompt caching keys on.
+_STAGE_1_SYSTEM_MSG = {"role": "system", "content": STAGE_1_SYSTEM}
+_STAGE_2_SYSTEM_MSG = {"role": "system", "content": STAGE_2_SYSTEM}
 
-def clean_json(text: str) -> str:
-    """Strip markdown fences if present."""
-    t = text.strip()
-    if t.startswith("```"):
-        t = t.split("\n", 1)[1].rsplit("```", 1)[0].strip()
-    return t
+# Groq JSON mode: replies are guaranteed to be one bare JSON object, so they
+# parse straight into orjson with no fence stripping or retry-on-prose
+JSON_OBJECT = {"type": "json_object"}
 
 
-def generate_episode(question: str) -> dict:
+def estimate_tokens(messages: list[dict], max_tokens: int) -> int:
+    """Rough TPM cost of a chat call: ~4 chars per prompt token + the output budget."""
+    return sum(len(m["content"]) for m in messages) // 4 + max_tokens
+
+
+async def generate_episode(question: str) -> dict:
     """Run the 2-stage prompt chain. Returns episode JSON."""
     t0 = time.time()
 
     # Stage 1: Research & Outline
     log.info(f"Stage 1: Generating outline for '{question}'...")
-    s1 = client.chat.completions.create(
+    s1_messages = [
+        _STAGE_1_SYSTEM_MSG,
+        {"role": "user", "content": STAGE_1_USER.format(question=question)},
+    ]
+    s1 = await GROQ.call(
+        client.chat.completions.create,
+        est_tokens=estimate_tokens(s1_messages, 4096),
         model=MODEL,
         max_tokens=4096,
         temperature=0.7,
-        messages=[
-            {"role": "system", "content": STAGE_1_SYSTEM},
-            {"role": "user", "content": STAGE_1_USER.format(question=question)},
-        ],
+        response_format=JSON_OBJECT,
+        messages=s1_messages,
     )
-    outline_text = clean_json(s1.choices[0].message.content)
-    outline = json.loads(outline_text)
+    outline_text = s1.choices[0].message.content
+    outline = orjson.loads(outline_text)
     s1_time = time.time() - t0
     log.info(f"Stage 1 done: {s1_time:.1f}s, experts: {[e['name'] for e in outline.get('experts', [])]}")
 
     # Stage 2: Script Generation
     t1 = time.time()
     log.info("Stage 2: Generating script...")
-    s2 = client.chat.completions.create(
+    s2_messages = [
+        _STAGE_2_SYSTEM_MSG,
+        {"role": "user", "content": STAGE_2_USER.format(outline=outline_text)},
+    ]
+    s2 = await GROQ.call(
+        client.chat.completions.create,
+        est_tokens=estimate_tokens(s2_messages, 16384),
         model=MODEL,
         max_tokens=16384,
         temperature=0.7,
-        messages=[
-            {"role": "system", "content": STAGE_2_SYSTEM},
-            {"role": "user", "content": STAGE_2_USER.format(outline=outline_text)},
-        ],
+        response_format=JSON_OBJECT,
+        messages=s2_messages,
     )
-    script_text = clean_json(s2.choices[0].message.content)
-    script = json.loads(script_text)
+    script = orjson.loads(s2.choices[0].message.content)
     s2_time = time.time() - t1
     total_scenes = sum(len(a["scenes"]) for a in script.get("acts", []))
     log.info(f"Stage 2 done: {s2_time:.1f}s, {total_scenes} scenes")
@@ -118,39 +227,58 @@ def generate_episode(question: str) -> dict:
 
 # ─── ROUTES ──────────────────────────────────────────────────────────────────
 
+class ORJSONResponse(JSONResponse):
+    """JSONResponse that serializes straight to bytes with orjson."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+
+# The single-page frontend, read once — it only changes on deploy
+with open(os.path.join(os.path.dirname(__file__), "static", "index.html"), "rb") as f:
+    INDEX_HTML = f.read()
+
+
 async def homepage(request):
-    return FileResponse(
-        os.path.join(os.path.dirname(__file__), "static", "index.html"),
+    return Response(
+        INDEX_HTML,
         media_type="text/html",
+        headers={"Cache-Control": "public, max-age=60"},
     )
 
 
 async def health(request):
-    return JSONResponse({"status": "ok", "model": MODEL})
+    return ORJSONResponse({"status": "ok", "model": MODEL})
 
 
 async def api_generate(request):
     try:
-        body = await request.json()
+        body = orjson.loads(await request.body())
         question = body.get("question", "").strip()
         if not question:
-            return JSONResponse({"error": "No question provided"}, status_code=400)
+            return ORJSONResponse({"error": "No question provided"}, status_code=400)
         if len(question) > 200:
-            return JSONResponse({"error": "Question too long"}, status_code=400)
+            return ORJSONResponse({"error": "Question too long"}, status_code=400)
 
-        episode = generate_episode(question)
+        slug = slugify(question)
+        cached = LIBRARY.get(slug)
+        if cached is not None:
+            # Known question — serve the saved episode, zero API calls
+            log.info(f"Library hit: {slug}")
+            episode = copy.deepcopy(cached)
+        else:
+            episode = await generate_episode(question)
         
         # Build voice map and attach to episode for frontend
-        characters = episode.get("characters", {})
-        voice_map = build_expert_voice_map(characters)
-        episode["voice_map"] = voice_map
+        if "voice_map" not in episode:
+            episode["voice_map"] = build_expert_voice_map(episode.get("characters", {}))
         
-        # Generate episode key for TTS caching
-        episode_key = f"{hash(question)}_{int(time.time())}"
-        episode["episode_key"] = episode_key
+        # The slug is the episode's one identifier: library file, sidecar
+        # audio directory and batch TTS all key on it
+        episode["slug"] = slug
         
         # Save to library for free replay
-        save_episode(episode)
+        await asyncio.to_thread(save_episode, episode)
         
         # Shuffle quiz answer positions so correct isn't always first
         for act in episode.get("acts", []):
@@ -158,17 +286,84 @@ async def api_generate(request):
                 if scene.get("type") == "quiz" and scene.get("options"):
                     random.shuffle(scene["options"])
         
-        return JSONResponse(episode)
+        return ORJSONResponse(episode)
 
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         log.error(f"JSON parse error from LLM: {e}")
-        return JSONResponse(
+        return ORJSONResponse(
             {"error": "Failed to generate valid episode. Try again!"},
             status_code=500,
         )
     except Exception as e:
         log.error(f"Generation error: {e}")
-        return JSONResponse({"error": str(e)}, status_code=500)
+        return ORJSONResponse({"error": str(e)}, status_code=500)
+
+
+# Strong refs to fire-and-forget tasks (the loop only keeps weak ones)
+_background: set[asyncio.Task] = set()
+
+
+async def cached_audio(text: str, voice: str, emotion: str) -> bytes | None:
+    """Already-rendered audio from the memory LRU or the disk cache, or None."""
+    cache_key = speech_cache_key(text, voice, emotion)
+    audio_bytes = tts_cache.get(cache_key)
+    if audio_bytes is None:
+        audio_bytes = await asyncio.to_thread(cached_speech, text, voice, emotion)
+        if audio_bytes is not None:
+            tts_cache.put(cache_key, audio_bytes)
+    return audio_bytes
+
+
+async def speak(text: str, voice: str, emotion: str, character: str = "") -> bytes:
+    """TTS through the caches: memory LRU, then disk, then rate-limited ElevenLabs."""
+    audio_bytes = await cached_audio(text, voice, emotion)
+    if audio_bytes is None:
+        cache_key = speech_cache_key(text, voice, emotion)
+        audio_bytes = await coalesce(
+            cache_key,
+            lambda: ELEVENLABS.call(generate_speech, text, voice, emotion, character),
+            TTS_TIMEOUT,
+        )
+        tts_cache.put(cache_key, audio_bytes)
+    return audio_bytes
+
+
+_SCENE_KEY = re.compile(r"^\d+-\d+$")
+
+
+def scene_audio_path(slug: str, scene_key: str) -> str | None:
+    """library/<slug>/<scene_key>.mp3, or None if either part isn't a safe name."""
+    if not slug or slug != slugify(slug) or not _SCENE_KEY.match(scene_key):
+        return None
+    return os.path.join(LIBRARY_DIR, slug, f"{scene_key}.mp3")
+
+
+def store_scene_audio(slug: str, audio_map: dict[str, bytes]):
+    """Write each scene's MP3 as its own sidecar file — the episode JSON is never touched."""
+    if not os.path.exists(os.path.join(LIBRARY_DIR, f"{slug}.json")):
+        return
+    stored = 0
+    for scene_key, audio_bytes in audio_map.items():
+        path = scene_audio_path(slug, scene_key)
+        if not path or os.path.exists(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique temp file per write: /api/tts and the batch route can store
+        # the same scene at once (same bytes — whichever replace lands wins)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(audio_bytes)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        stored += 1
+    if stored:
+        log.info(f"Cached {stored} scenes of audio: {slug}")
 
 
 async def api_tts(request):
@@ -179,13 +374,15 @@ async def api_tts(request):
         "text": "What the character says",
         "character": "nova",
         "emotion": "excited",
-        "voice": "EXAVITQu4vr4xnSDxMaL"  (ElevenLabs voice ID from voice_map)
+        "voice": "EXAVITQu4vr4xnSDxMaL",  (ElevenLabs voice ID from voice_map)
+        "slug": "why-is-the-sky-blue",    (optional — episode slug, to keep the audio)
+        "scene_key": "0-3"                (optional — act-scene index)
     }
     
-    Returns: audio/wav
+    Returns: audio/mpeg, streamed as it is synthesized on a cache miss
     """
     try:
-        body = await request.json()
+        body = orjson.loads(await request.body())
         text = body.get("text", "").strip()
         voice = body.get("voice", "troy")
         emotion = body.get("emotion", "neutral")
@@ -194,74 +391,125 @@ async def api_tts(request):
         scene_key = body.get("scene_key", "")
         
         if not text:
-            return JSONResponse({"error": "No text provided"}, status_code=400)
+            return ORJSONResponse({"error": "No text provided"}, status_code=400)
         
         log.info(f"TTS: voice={voice}, emotion={emotion}, text='{text[:50]}...'")
         t0 = time.time()
+        headers = {"Cache-Control": "public, max-age=3600"}
         
-        audio_bytes = generate_speech(text, voice, emotion, character)
-        
-        log.info(f"TTS done: {time.time() - t0:.2f}s, {len(audio_bytes)} bytes")
-        
-        # Cache audio in library episode if slug+scene_key provided
-        if slug and scene_key and audio_bytes:
+        async def keep(audio_bytes):
+            # Cache audio next to the library episode if slug+scene_key provided
+            if slug and scene_key and audio_bytes:
+                try:
+                    await asyncio.to_thread(store_scene_audio, slug, {scene_key: audio_bytes})
+                except Exception as ce:
+                    log.warning(f"Audio cache write failed: {ce}")
+        
+        cache_key = speech_cache_key(text, voice, emotion)
+        audio_bytes = await cached_audio(text, voice, emotion)
+        if audio_bytes is None:
+            audio_bytes = await join_inflight(cache_key, TTS_TIMEOUT)
+        if audio_bytes is not None:
+            log.info(f"TTS cached: {time.time() - t0:.2f}s, {len(audio_bytes)} bytes")
+            await keep(audio_bytes)
+            return Response(content=audio_bytes, media_type="audio/mpeg", headers=headers)
+        
+        # Cache miss: relay MP3 chunks as ElevenLabs renders them, and cache
+        # the full clip once the last chunk has arrived. The upstream is read
+        # at its own pace by a background task, which holds the ElevenLabs
+        # slot only until ElevenLabs is done: a client that stops reading
+        # slows nothing but its own response.
+        fut = start_inflight(cache_key)
+        try:
+            upstream = await ELEVENLABS.call(open_speech_stream, text, voice, emotion, character,
+                                             hold=True)
+        except BaseException:
+            finish_inflight(cache_key, fut, None)
+            raise
+        chunks = asyncio.Queue()  # MP3 chunks, then None (done) or the error
+        
+        async def drain():
+            parts = []
+            audio_bytes = None
             try:
-                import base64
-                ep_path = os.path.join(LIBRARY_DIR, f"{slug}.json")
-                if os.path.exists(ep_path):
-                    with open(ep_path) as f:
-                        ep_data = json.load(f)
-                    if "audio_cache" not in ep_data:
-                        ep_data["audio_cache"] = {}
-                    if scene_key not in ep_data["audio_cache"]:
-                        ep_data["audio_cache"][scene_key] = base64.b64encode(audio_bytes).decode("ascii")
-                        with open(ep_path, "w") as f:
-                            json.dump(ep_data, f)
-                        log.info(f"Cached audio: {slug}/{scene_key}")
+                async for chunk in upstream.aiter_bytes():
+                    parts.append(chunk)
+                    chunks.put_nowait(chunk)
+                if not parts:
+                    raise ElevenLabsError(502, "empty audio")
+                audio_bytes = b"".join(parts)
+                # Cached before the in-flight entry goes, so a request for the
+                # same line never finds neither and synthesizes it again
+                tts_cache.put(cache_key, audio_bytes)
+                chunks.put_nowait(None)
+            except Exception as e:
+                log.warning(f"TTS stream failed: {e}")
+                chunks.put_nowait(e)
+                return
+            finally:
+                finish_inflight(cache_key, fut, audio_bytes)
+                try:
+                    await upstream.aclose()
+                finally:
+                    await ELEVENLABS.release()
+            log.info(f"TTS done: {time.time() - t0:.2f}s, {len(audio_bytes)} bytes")
+            try:
+                await asyncio.to_thread(store_speech, text, voice, emotion, audio_bytes)
             except Exception as ce:
-                log.warning(f"Audio cache write failed: {ce}")
-        
-        return Response(
-            content=audio_bytes,
-            media_type="audio/mpeg",
-            headers={
-                "Cache-Control": "public, max-age=3600",
-            },
-        )
+                log.warning(f"TTS cache write failed: {ce}")
+            await keep(audio_bytes)
+        
+        drainer = asyncio.create_task(drain())
+        _background.add(drainer)
+        drainer.add_done_callback(_background.discard)
+        
+        async def relay():
+            while (chunk := await chunks.get()) is not None:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        
+        return StreamingResponse(relay(), media_type="audio/mpeg", headers=headers)
         
     except Exception as e:
         log.error(f"TTS error: {e}")
-        return JSONResponse({"error": str(e)}, status_code=500)
+        return ORJSONResponse({"error": str(e)}, status_code=500)
 
 
 async def api_library(request):
     """List all saved episodes in the library."""
-    episodes = load_library()
-    return JSONResponse({"episodes": episodes})
+    body = await asyncio.to_thread(library_listing_json)
+    return Response(body, media_type="application/json")
 
 
 async def api_library_audio(request):
     """Serve cached audio for a specific scene from the library.
-    Returns WAV audio if cached, 404 if not.
+    Returns MP3 audio if cached, 404 if not.
     """
     slug = request.path_params.get("slug", "")
     scene_key = request.path_params.get("scene_key", "")
     
+    path = scene_audio_path(slug, scene_key)
+    if path is None:
+        return ORJSONResponse({"error": "Episode not found"}, status_code=404)
+    if os.path.exists(path):
+        return FileResponse(path, media_type="audio/mpeg")
+    
+    # Older episodes embed base64 audio in the episode JSON itself
     ep_path = os.path.join(LIBRARY_DIR, f"{slug}.json")
     if not os.path.exists(ep_path):
-        return JSONResponse({"error": "Episode not found"}, status_code=404)
+        return ORJSONResponse({"error": "Episode not found"}, status_code=404)
     
     try:
         import base64
-        with open(ep_path) as f:
-            ep_data = json.load(f)
+        ep_data = await asyncio.to_thread(_read_episode, ep_path)
         audio_b64 = ep_data.get("audio_cache", {}).get(scene_key)
         if not audio_b64:
-            return JSONResponse({"error": "Audio not cached"}, status_code=404)
+            return ORJSONResponse({"error": "Audio not cached"}, status_code=404)
         audio_bytes = base64.b64decode(audio_b64)
         return Response(content=audio_bytes, media_type="audio/mpeg")
     except Exception as e:
-        return JSONResponse({"error": str(e)}, status_code=500)
+        return ORJSONResponse({"error": str(e)}, status_code=500)
 
 
 async def api_library_episode(request):
@@ -270,19 +518,20 @@ async def api_library_episode(request):
     path = os.path.join(LIBRARY_DIR, f"{slug}.json")
     
     if not os.path.exists(path):
-        return JSONResponse({"error": "Episode not found"}, status_code=404)
+        return ORJSONResponse({"error": "Episode not found"}, status_code=404)
     
     try:
-        with open(path) as f:
-            episode = json.load(f)
+        episode = await asyncio.to_thread(_read_episode, path)
+        
+        episode["slug"] = slug
         
         # Ensure voice_map exists
         if "voice_map" not in episode:
             episode["voice_map"] = build_expert_voice_map(episode.get("characters", {}))
         
-        return JSONResponse(episode)
+        return ORJSONResponse(episode)
     except Exception as e:
-        return JSONResponse({"error": str(e)}, status_code=500)
+        return ORJSONResponse({"error": str(e)}, status_code=500)
 
 
 
@@ -295,18 +544,19 @@ async def api_tts_batch(request):
     Returns: { "audio": { "0-0": "base64mp3", ... } }
     """
     import base64
-    import asyncio
     try:
-        body = await request.json()
+        body = orjson.loads(await request.body())
         episode = body.get("episode", {})
         
         if not episode.get("acts"):
-            return JSONResponse({"error": "No episode data"}, status_code=400)
+            return ORJSONResponse({"error": "No episode data"}, status_code=400)
         
         voice_map = episode.get("voice_map", {})
         if not voice_map:
             voice_map = build_expert_voice_map(episode.get("characters", {}))
         
+        render = make_renderer(voice_map, "pNInz6obpgDQGcFmaJgB")
+        
         # Collect all scenes that need audio
         scenes_to_generate = []
         for ai, act in enumerate(episode["acts"]):
@@ -315,12 +565,10 @@ async def api_tts_batch(request):
                 key = f"{ai}-{si}"
                 
                 if scene_type in ("dialogue", "explanation") and scene.get("text"):
-                    char_id = scene.get("character", "")
-                    voice_id = voice_map.get(char_id, "pNInz6obpgDQGcFmaJgB")
-                    emotion = scene.get("emotion", "neutral")
+                    text, voice_id, emotion, char_id = render(scene)
                     scenes_to_generate.append({
                         "key": key,
-                        "text": scene["text"],
+                        "text": text,
                         "voice": voice_id,
                         "emotion": emotion,
                         "character": char_id,
@@ -362,28 +610,47 @@ async def api_tts_batch(request):
         log.info(f"Batch TTS: generating {len(scenes_to_generate)} scenes")
         t0 = time.time()
         
-        # Run blocking TTS calls in a thread to not block the event loop
-        def generate_all():
-            audio_map = {}
-            for i, s in enumerate(scenes_to_generate):
-                try:
-                    audio_bytes = generate_speech(s["text"], s["voice"], s["emotion"], s["character"])
-                    audio_map[s["key"]] = base64.b64encode(audio_bytes).decode("ascii")
-                    if (i+1) % 5 == 0:
-                        log.info(f"  Batch TTS progress: {i+1}/{len(scenes_to_generate)}")
-                except Exception as e:
-                    log.warning(f"  Batch TTS {s['key']} FAILED: {e}")
-            return audio_map
+        # Fan out every scene at once — the ElevenLabs limiter caps concurrency
+        done = 0
+        
+        async def one(text, voice, emotion, character):
+            nonlocal done
+            audio_bytes = await speak(text, voice, emotion, character)
+            done += 1
+            if done % 5 == 0:
+                log.info(f"  Batch TTS progress: {done}/{len(scenes_to_generate)}")
+            return audio_bytes
         
-        audio_map = await asyncio.to_thread(generate_all)
+        results = await generate_episode_audio(
+            {s["key"]: (s["text"], s["voice"], s["emotion"], s["character"]) for s in scenes_to_generate},
+            synthesize=one,
+        )
+        
+        audio_map = {}
+        scene_audio = {}
+        for key, result in results.items():
+            if isinstance(result, Exception):
+                log.warning(f"  Batch TTS {key} FAILED: {result}")
+            else:
+                scene_audio[key] = result
+                audio_map[key] = base64.b64encode(result).decode("ascii")
         
         log.info(f"Batch TTS done: {len(audio_map)}/{len(scenes_to_generate)} scenes in {time.time()-t0:.1f}s")
         
-        return JSONResponse({"audio": audio_map})
+        # Persist into the library copy of this episode, if there is one
+        if audio_map:
+            slug = episode.get("slug") or slugify(episode.get("question", ""))
+            if slug in LIBRARY:
+                try:
+                    await asyncio.to_thread(store_scene_audio, slug, scene_audio)
+                except Exception as ce:
+                    log.warning(f"Audio cache write failed: {ce}")
+        
+        return ORJSONResponse({"audio": audio_map})
         
     except Exception as e:
         log.error(f"Batch TTS error: {e}")
-        return JSONResponse({"error": str(e)}, status_code=500)
+        return ORJSONResponse({"error": str(e)}, status_code=500)
 
 async def api_stt(request):
     """Transcribe audio to text using Groq Whisper.
@@ -399,24 +666,25 @@ async def api_stt(request):
         audio_file = form.get("audio")
         
         if not audio_file:
-            return JSONResponse({"error": "No audio file provided"}, status_code=400)
+            return ORJSONResponse({"error": "No audio file provided"}, status_code=400)
         
-        # Read the uploaded audio bytes
-        audio_bytes = await audio_file.read()
+        # Starlette already spooled the upload; pass its file object through
+        # so the SDK streams it rather than us copying it into memory first.
+        size = audio_file.size or 0
+        if size < 1000:
+            return ORJSONResponse({"error": "Audio too short"}, status_code=400)
         
-        if len(audio_bytes) < 1000:
-            return JSONResponse({"error": "Audio too short"}, status_code=400)
-        
-        log.info(f"STT: received {len(audio_bytes)} bytes of audio")
+        log.info(f"STT: received {size} bytes of audio")
         t0 = time.time()
         
         # Detect format from the uploaded filename
         filename = getattr(audio_file, 'filename', 'question.mp4') or 'question.mp4'
-        log.info(f"STT: filename={filename}, {len(audio_bytes)} bytes")
+        log.info(f"STT: filename={filename}, {size} bytes")
         
         # Send to Groq Whisper
-        transcription = client.audio.transcriptions.create(
-            file=(filename, audio_bytes),
+        transcription = await GROQ.call(
+            client.audio.transcriptions.create,
+            file=(filename, audio_file.file, audio_file.content_type),
             model="whisper-large-v3-turbo",
             language="en",
             temperature=0.0,
@@ -426,11 +694,11 @@ async def api_stt(request):
         text = transcription.text.strip()
         log.info(f"STT done: {time.time() - t0:.2f}s, text='{text}'")
         
-        return JSONResponse({"text": text})
+        return ORJSONResponse({"text": text})
         
     except Exception as e:
         log.error(f"STT error: {e}")
-        return JSONResponse({"error": str(e)}, status_code=500)
+        return ORJSONResponse({"error": str(e)}, status_code=500)
 
 
 static_dir = os.path.join(os.path.dirname(__file__), "static")
@@ -448,7 +716,14 @@ routes = [
     Mount("/static", StaticFiles(directory=static_dir), name="static"),
 ]
 
-app = Starlette(routes=routes)
+@asynccontextmanager
+async def lifespan(app):
+    await asyncio.to_thread(preload_library)
+    yield
+    await close_http()  # also the transport under `client`
+
+
+app = Starlette(routes=routes, lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -459,4 +734,13 @@ app.add_middleware(
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Each worker holds its own LIBRARY, caches and provider rate limiters,
+    # so more than one worker multiplies the effective API rate — hence 1
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.environ.get("WEB_CONCURRENCY", "1")),
+    )
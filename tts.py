@@ -10,14 +10,38 @@ Voice casting:
   Experts — rotated from a pool of distinct voices
 """
 import os
+import asyncio
+import hashlib
+import functools
 import logging
-import requests
+import itertools
+import tempfile
+import threading
+import unicodedata
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+import httpx
+import orjson
+
+from http_pool import HTTP
 
 log = logging.getLogger("wunderbots.tts")
 
 ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY", "")
 ELEVENLABS_BASE = "https://api.elevenlabs.io/v1"
 MODEL_ID = "eleven_flash_v2_5"  # Fast, cheap (0.5 credits/char on Starter+)
+OUTPUT_FORMAT = "mp3_44100_128"
+_MODEL_ID_JSON = orjson.dumps(MODEL_ID)
+
+TTS_TIMEOUT = 30  # seconds — a clip that takes longer is not coming back
+
+# Same on every call — built once (treat as read-only)
+_HEADERS = {
+    "accept": "audio/mpeg",
+    "xi-api-key": ELEVENLABS_API_KEY,
+    "Content-Type": "application/json",
+}
 
 # ─── Voice IDs ───────────────────────────────────────────────────────────────
 # These are ElevenLabs default library voices. You can swap them for custom
@@ -35,6 +59,22 @@ GUIDE_VOICES = {
     "pip": "cN9lACJjByQco3FyvGzE",       # Custom voice — soft, gentle, whimsical fairy/owl character
 }
 
+# Audio encoding per character. Bolt's and Pip's cartoon voices lose nothing
+# audible at 22 kHz / 32 kbps on tablet speakers, at a quarter of the bytes;
+# everyone else gets OUTPUT_FORMAT.
+CHARACTER_FORMATS = {
+    "nova": "mp3_44100_64",
+    "bolt": "mp3_22050_32",
+    "pip": "mp3_22050_32",
+}
+_VOICE_FORMATS = {GUIDE_VOICES[c]: fmt for c, fmt in CHARACTER_FORMATS.items()}
+
+
+def output_format_for(voice_id: str) -> str:
+    """ElevenLabs output_format for a voice (all formats are MP3)."""
+    return _VOICE_FORMATS.get(voice_id, OUTPUT_FORMAT)
+
+
 # Pool of voices for rotating experts (each episode gets different experts)
 EXPERT_VOICES_FEMALE = [
     "67oeJmj7jIMsdE6yXPr5",   # Custom F1 — warm mentor, Ms. Frizzle energy
@@ -59,35 +99,46 @@ NARRATOR_VOICE = "CeNX9CMwmxDxUF5Q2Inm"  # Custom — exciting kids show announc
 PROCTOR_VOICE = "4QLC5fepxZkYmdD2IGRU"   # Custom — quiz proctor, clear and encouraging
 
 # ─── Emotion → voice settings + stage directions ─────────────────────────────
-# ElevenLabs reads emotion from textual cues. We prepend stage directions
-# that make the voice more animated and expressive — like a cartoon show.
+# Each emotion is one EmotionSpec: the voice_settings that make the delivery
+# animated and expressive — like a cartoon show — plus its stage direction.
 # Lower stability = more expressive delivery, more variation.
 
-EMOTION_SETTINGS = {
-    "excited":    {"stability": 0.2, "similarity_boost": 0.75, "style": 0.4},
-    "happy":      {"stability": 0.25, "similarity_boost": 0.75, "style": 0.3},
-    "silly":      {"stability": 0.15, "similarity_boost": 0.65, "style": 0.5},
-    "surprised":  {"stability": 0.2, "similarity_boost": 0.7, "style": 0.4},
-    "explaining": {"stability": 0.35, "similarity_boost": 0.8, "style": 0.2},
-    "thinking":   {"stability": 0.35, "similarity_boost": 0.8, "style": 0.2},
-    "shy":        {"stability": 0.4, "similarity_boost": 0.85, "style": 0.15},
-    "neutral":    {"stability": 0.3, "similarity_boost": 0.75, "style": 0.2},
+@dataclass(frozen=True, slots=True)
+class EmotionSpec:
+    """ElevenLabs voice_settings and stage direction for one emotion."""
+    stability: float
+    similarity_boost: float
+    style: float
+    # Performance cue for the emotion. ElevenLabs speaks ALL text aloud, so
+    # this is never sent — kept for prompts and other directable backends.
+    direction: str
+
+
+EMOTIONS = {
+    "excited":    EmotionSpec(0.2, 0.75, 0.4, "*with big excited energy, like a kid on Christmas morning*"),
+    "happy":      EmotionSpec(0.25, 0.75, 0.3, "*warmly, with a big smile in the voice*"),
+    "silly":      EmotionSpec(0.15, 0.65, 0.5, "*being goofy and playful, hamming it up*"),
+    "surprised":  EmotionSpec(0.2, 0.7, 0.4, "*gasping with genuine surprise and wonder*"),
+    "explaining": EmotionSpec(0.35, 0.8, 0.2, "*enthusiastically teaching, like a favorite teacher*"),
+    "thinking":   EmotionSpec(0.35, 0.8, 0.2, "*thoughtfully, working through an idea out loud*"),
+    "shy":        EmotionSpec(0.4, 0.85, 0.15, "*softly and gently, a little quiet but sincere*"),
+    "neutral":    EmotionSpec(0.3, 0.75, 0.2, "*in a warm, friendly, animated tone*"),
 }
 
-# Stage directions prepended to text — ElevenLabs interprets these as
-# performance cues, making the voice delivery more animated and character-like.
-# These are NOT spoken aloud; ElevenLabs uses them to color the delivery.
-EMOTION_DIRECTIONS = {
-    "excited":    "*with big excited energy, like a kid on Christmas morning*",
-    "happy":      "*warmly, with a big smile in the voice*",
-    "silly":      "*being goofy and playful, hamming it up*",
-    "surprised":  "*gasping with genuine surprise and wonder*",
-    "explaining": "*enthusiastically teaching, like a favorite teacher*",
-    "thinking":   "*thoughtfully, working through an idea out loud*",
-    "shy":        "*softly and gently, a little quiet but sincere*",
-    "neutral":    "*in a warm, friendly, animated tone*",
+# voice_settings per emotion, serialized once — requests splice these bytes
+# straight into the body instead of re-encoding the same dict every call
+_EMOTION_VS = {
+    emotion: orjson.dumps({
+        "stability": spec.stability,
+        "similarity_boost": spec.similarity_boost,
+        "style": spec.style,
+        "use_speaker_boost": True,
+    })
+    for emotion, spec in EMOTIONS.items()
 }
 
+EMOTION_DIRECTIONS = {emotion: spec.direction for emotion, spec in EMOTIONS.items()}
+
 # Character-specific voice directions that layer on top of emotion
 CHARACTER_DIRECTIONS = {
     "nova":  "Speaking as Nova, a confident and curious young adventurer. ",
@@ -96,38 +147,256 @@ CHARACTER_DIRECTIONS = {
 }
 
 
-def build_expert_voice_map(characters: dict) -> dict:
+# ─── Disk cache ──────────────────────────────────────────────────────────────
+# The same lines ("Whoa!", "Hi, I'm Nova!") recur across episodes, so audio
+# is cached by content: each (voice, emotion, text) is synthesized only once.
+# The cache is an LRU bounded by size: hits refresh a file's mtime, and once
+# the directory outgrows TTS_CACHE_MAX_MB the least recently used files go.
+
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR") or os.path.expanduser("~/.cache/wunderbots/tts")
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_MB", "500")) * 1024 * 1024
+
+_cache_lock = threading.Lock()
+_cache_bytes: int | None = None  # running directory size, measured on first write
+
+
+def speech_cache_key(text: str, voice_id: str, emotion: str) -> str:
+    """Content hash identifying one rendered line of audio.
+
+    Covers everything that changes the output — model, encoding, voice,
+    emotion and the text (stripped, NFC-normalized) — so a model or format
+    change never serves stale audio and cosmetic whitespace/Unicode
+    differences still hit.
+    """
+    if emotion not in EMOTIONS:
+        emotion = "neutral"
+    h = _key_prefix(voice_id, emotion).copy()
+    h.update(unicodedata.normalize("NFC", text.strip()).encode())
+    return h.hexdigest()
+
+
+@functools.lru_cache(maxsize=256)
+def _key_prefix(voice_id: str, emotion: str):
+    """SHA-256 state after "model|format|voice|emotion|" — hashed once per
+    voice/emotion pair, then copied per line (read-only once cached)."""
+    fmt = output_format_for(voice_id)
+    return hashlib.sha256(f"{MODEL_ID}|{fmt}|{voice_id}|{emotion}|".encode())
+
+
+def speech_cache_path(text: str, voice_id: str, emotion: str) -> str:
+    """Where this line's MP3 lives (or will live) in the disk cache."""
+    return os.path.join(TTS_CACHE_DIR, f"{speech_cache_key(text, voice_id, emotion)}.mp3")
+
+
+def cached_speech(text: str, voice_id: str, emotion: str = "neutral") -> bytes | None:
+    """Return previously synthesized audio from the disk cache, or None."""
+    path = speech_cache_path(text, voice_id, emotion)
+    try:
+        with open(path, "rb") as f:
+            audio = f.read()
+        os.utime(path)  # mark as recently used
+        return audio
+    except FileNotFoundError:
+        return None
+
+
+def cached_speech_path(text: str, voice_id: str, emotion: str = "neutral") -> str | None:
+    """Path of previously synthesized audio in the disk cache, or None."""
+    path = speech_cache_path(text, voice_id, emotion)
+    try:
+        os.utime(path)  # mark as recently used
+        return path
+    except FileNotFoundError:
+        return None
+
+
+def build_expert_voice_map(characters: dict[str, dict]) -> dict[str, str]:
     """Build a character_id → voice_id map for an episode's characters.
     
     Uses the expert's gender field to pick from the right voice pool.
     Falls back to the combined pool if gender isn't specified.
     """
-    voice_map = {}
-    female_idx = 0
-    male_idx = 0
-    fallback_idx = 0
+    voice_map: dict[str, str] = {}
+    female = itertools.cycle(EXPERT_VOICES_FEMALE)
+    male = itertools.cycle(EXPERT_VOICES_MALE)
+    fallback = itertools.cycle(EXPERT_VOICE_POOL)
 
     for char_id, char in characters.items():
-        if char_id in GUIDE_VOICES:
-            voice_map[char_id] = GUIDE_VOICES[char_id]
+        guide_voice = GUIDE_VOICES.get(char_id)
+        if guide_voice is not None:
+            voice_map[char_id] = guide_voice
         else:
             gender = char.get("gender", "").lower() if isinstance(char, dict) else ""
             if gender == "female":
-                voice_map[char_id] = EXPERT_VOICES_FEMALE[female_idx % len(EXPERT_VOICES_FEMALE)]
-                female_idx += 1
+                voice_map[char_id] = next(female)
             elif gender == "male":
-                voice_map[char_id] = EXPERT_VOICES_MALE[male_idx % len(EXPERT_VOICES_MALE)]
-                male_idx += 1
+                voice_map[char_id] = next(male)
             else:
                 # No gender specified — use combined pool
-                voice_map[char_id] = EXPERT_VOICE_POOL[fallback_idx % len(EXPERT_VOICE_POOL)]
-                fallback_idx += 1
+                voice_map[char_id] = next(fallback)
 
     return voice_map
 
 
-def generate_speech(text: str, voice_id: str, emotion: str = "neutral",
-                    character: str = "") -> bytes:
+def make_renderer(voice_map: dict, default_voice: str):
+    """Specialize scene → TTS job for one episode's voice map.
+
+    The returned function maps a dialogue scene to the
+    (text, voice_id, emotion, character) tuple generate_episode_audio takes.
+    Lookups are bound once per episode instead of redone per scene. No
+    direction prefix is added — ElevenLabs would read it aloud.
+    """
+    voice_for = voice_map.get
+    known_emotions = EMOTIONS.keys()
+
+    def render(scene: dict) -> tuple[str, str, str, str]:
+        character = scene.get("character", "")
+        emotion = scene.get("emotion", "neutral")
+        if emotion not in known_emotions:
+            emotion = "neutral"
+        return scene["text"], voice_for(character, default_voice), emotion, character
+
+    return render
+
+
+def _write_cache(path: str, audio: bytes):
+    fd, tmp_path = _cache_tmp()
+    with os.fdopen(fd, "wb") as f:
+        f.write(audio)
+    _commit_cache(tmp_path, path, len(audio))
+
+
+def _cache_tmp() -> tuple[int, str]:
+    # Write to a temp file first so a concurrent reader never sees half an MP3
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    return tempfile.mkstemp(dir=TTS_CACHE_DIR, suffix=".tmp")
+
+
+def _commit_cache(tmp_path: str, path: str, size: int):
+    """Move a fully written temp file into place and account for it."""
+    os.replace(tmp_path, path)
+    _account_cache(size)
+
+
+def _account_cache(added: int):
+    """Track the cache's size after a write, evicting if it outgrew the limit."""
+    global _cache_bytes
+    with _cache_lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(e.stat().st_size for e in os.scandir(TTS_CACHE_DIR)
+                               if e.name.endswith(".mp3"))
+        else:
+            _cache_bytes += added
+        if _cache_bytes > TTS_CACHE_MAX_BYTES:
+            _evict_cache()
+
+
+def _evict_cache():
+    """Drop least recently used files until the cache fits its size limit."""
+    global _cache_bytes
+    entries = sorted((e.stat().st_mtime, e.stat().st_size, e.path)
+                     for e in os.scandir(TTS_CACHE_DIR) if e.name.endswith(".mp3"))
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    for _, size, path in entries:
+        if total <= TTS_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        evicted += 1
+    _cache_bytes = total
+    log.info("TTS cache: evicted %d files, %d KB left", evicted, total // 1024)
+
+
+class ElevenLabsError(RuntimeError):
+    """Non-200 reply from ElevenLabs. status_code lets the rate limiter tell
+    429s and 5xx (retried) from client errors (not)."""
+
+    def __init__(self, status_code: int, detail: str = ""):
+        super().__init__(f"ElevenLabs TTS failed: {status_code}" + (f" ({detail})" if detail else ""))
+        self.status_code = status_code
+
+
+# ─── Request coalescing ──────────────────────────────────────────────────────
+# Identical lines requested at the same time (concurrent episodes sharing a
+# stinger, a library replay racing a first play) share one ElevenLabs call.
+# Callers coalesce in front of the rate limiter, so a waiter holds no slot or
+# RPM entry and never sees the owner's 429s. Each future resolves to the
+# owner's result, or None if that attempt failed — waiters then go on to
+# synthesize for themselves. A key names what its future resolves to:
+# speech_cache_key → audio bytes, speech_cache_path → that file's path.
+
+_inflight: dict[str, asyncio.Future] = {}
+
+
+async def join_inflight(key: str, timeout: float | None = None):
+    """Wait for a request for `key` that is already running, if any."""
+    fut = _inflight.get(key)
+    if fut is None:
+        return None
+    try:
+        return await asyncio.wait_for(asyncio.shield(fut), timeout)
+    except asyncio.TimeoutError:
+        return None
+
+
+def start_inflight(key: str) -> asyncio.Future:
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[key] = fut
+    return fut
+
+
+def finish_inflight(key: str, fut: asyncio.Future, result):
+    if _inflight.get(key) is fut:
+        del _inflight[key]
+    if not fut.done():
+        fut.set_result(result)
+
+
+async def coalesce(key: str, producer, timeout: float | None = None):
+    """Await `producer()`, or share the result of one already running for `key`.
+
+    Pass the rate-limited call as `producer`, e.g.
+    `coalesce(key, lambda: ELEVENLABS.call(generate_speech, ...))`.
+    """
+    result = await join_inflight(key, timeout)
+    if result is not None:
+        return result
+    fut = start_inflight(key)
+    try:
+        result = await producer()
+    finally:
+        finish_inflight(key, fut, result)
+    return result
+
+
+def store_speech(text: str, voice_id: str, emotion: str, audio: bytes):
+    """Add rendered audio to the disk cache (blocking — call via to_thread)."""
+    _write_cache(speech_cache_path(text, voice_id, emotion), audio)
+
+
+def _speech_request(text: str, voice_id: str, emotion: str) -> tuple[dict, bytes]:
+    """Headers and JSON body for one ElevenLabs synthesis call."""
+    if not ELEVENLABS_API_KEY:
+        raise RuntimeError("ELEVENLABS_API_KEY not set")
+
+    # ElevenLabs speaks ALL text aloud — no hidden stage directions.
+    # Expressiveness comes from voice_settings (stability, style, similarity).
+    directed_text = text
+
+    body = b'{"text":%b,"model_id":%b,"voice_settings":%b}' % (
+        orjson.dumps(directed_text),
+        _MODEL_ID_JSON,
+        _EMOTION_VS.get(emotion, _EMOTION_VS["neutral"]),
+    )
+    return _HEADERS, body
+
+
+async def generate_speech(text: str, voice_id: str, emotion: str = "neutral",
+                          character: str = "") -> bytes:
     """Generate speech audio via ElevenLabs API with emotional stage directions.
 
     Args:
@@ -139,40 +408,129 @@ def generate_speech(text: str, voice_id: str, emotion: str = "neutral",
     Returns:
         MP3 audio bytes
     """
-    if not ELEVENLABS_API_KEY:
-        raise RuntimeError("ELEVENLABS_API_KEY not set")
-
     if not text.strip():
         raise ValueError("Empty text")
 
-    settings = EMOTION_SETTINGS.get(emotion, EMOTION_SETTINGS["neutral"])
+    cached = await asyncio.to_thread(cached_speech, text, voice_id, emotion)
+    if cached is not None:
+        return cached
 
-    # ElevenLabs speaks ALL text aloud — no hidden stage directions.
-    # Expressiveness comes from voice_settings (stability, style, similarity).
-    directed_text = text
+    # Same /stream endpoint as the live path — drained here for callers that
+    # need the whole clip (batch, library generation, cache)
+    response = await open_speech_stream(text, voice_id, emotion, character)
+    parts = []
+    try:
+        async for chunk in response.aiter_bytes():
+            parts.append(chunk)
+    finally:
+        await response.aclose()
+    audio = b"".join(parts)
+    if not audio:
+        raise ElevenLabsError(502, "empty audio")
+
+    await asyncio.to_thread(store_speech, text, voice_id, emotion, audio)
 
-    url = f"{ELEVENLABS_BASE}/text-to-speech/{voice_id}"
-    headers = {
-        "xi-api-key": ELEVENLABS_API_KEY,
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "text": directed_text,
-        "model_id": MODEL_ID,
-        "voice_settings": {
-            "stability": settings["stability"],
-            "similarity_boost": settings["similarity_boost"],
-            "style": settings.get("style", 0.0),
-            "use_speaker_boost": True,
-        },
-    }
-
-    log.info(f"TTS: char={character}, emotion={emotion}, {len(text)} chars")
-    response = requests.post(url, json=payload, headers=headers, timeout=30)
+    return audio
+
+
+async def open_speech_stream(text: str, voice_id: str, emotion: str = "neutral",
+                             character: str = "") -> httpx.Response:
+    """Start a streaming synthesis and return once ElevenLabs has answered.
+
+    The caller iterates `response.aiter_bytes()` to relay MP3 chunks as they
+    are rendered, and must `aclose()` the response. Nothing is cached here —
+    only the caller knows when the full clip has arrived.
+    """
+    if not text.strip():
+        raise ValueError("Empty text")
+
+    headers, body = _speech_request(text, voice_id, emotion)
+
+    log.info("TTS stream: char=%s, emotion=%s, %d chars", character, emotion, len(text))
+    request = HTTP.build_request("POST", f"{ELEVENLABS_BASE}/text-to-speech/{voice_id}/stream",
+                                 params={"output_format": output_format_for(voice_id)},
+                                 content=body, headers=headers, timeout=TTS_TIMEOUT)
+    response = await HTTP.send(request, stream=True)
 
     if response.status_code != 200:
-        error_detail = response.text[:200]
-        log.error(f"ElevenLabs API error {response.status_code}: {error_detail}")
-        raise RuntimeError(f"ElevenLabs TTS failed: {response.status_code}")
+        error_detail = (await response.aread())[:200]
+        await response.aclose()
+        log.error("ElevenLabs API error %d: %r", response.status_code, error_detail)
+        raise ElevenLabsError(response.status_code)
+
+    return response
+
+
+async def generate_speech_stream(text: str, voice_id: str, emotion: str = "neutral",
+                                 character: str = "") -> AsyncIterator[bytes]:
+    """Yield MP3 chunks as ElevenLabs renders them, for consumers that can
+    start playback or encoding before the clip is finished. Not cached."""
+    response = await open_speech_stream(text, voice_id, emotion, character)
+    try:
+        async for chunk in response.aiter_bytes():
+            yield chunk
+    finally:
+        await response.aclose()
+
+
+async def generate_speech_file(text: str, voice_id: str, emotion: str = "neutral",
+                               character: str = "") -> str:
+    """Path of this line's MP3 in the disk cache, synthesizing it on a miss.
 
-    return response.content
+    Chunks go from ElevenLabs straight to disk, so memory stays O(chunk)
+    however long the clip — for batch jobs that only need the file.
+    """
+    if not text.strip():
+        raise ValueError("Empty text")
+
+    cached = await asyncio.to_thread(cached_speech_path, text, voice_id, emotion)
+    if cached is not None:
+        return cached
+
+    response = await open_speech_stream(text, voice_id, emotion, character)
+    size = 0
+    try:
+        fd, tmp_path = await asyncio.to_thread(_cache_tmp)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in response.aiter_bytes():
+                    await asyncio.to_thread(f.write, chunk)
+                    size += len(chunk)
+            if not size:
+                # Never cache an empty clip; a 5xx status lets the limiter retry
+                raise ElevenLabsError(502, "empty audio")
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    finally:
+        await response.aclose()
+
+    path = speech_cache_path(text, voice_id, emotion)
+    await asyncio.to_thread(_commit_cache, tmp_path, path, size)
+    return path
+
+
+async def generate_episode_audio(jobs: dict, synthesize) -> dict:
+    """Render every line of an episode concurrently.
+
+    Args:
+        jobs: scene key → (text, voice_id, emotion, character)
+        synthesize: coroutine fn taking those four arguments. Every line is
+            started at once, so it must bound its own concurrency — e.g. by
+            going through ELEVENLABS.call — rather than be bare generate_speech
+
+    Returns:
+        scene key → synthesize's result, or the exception that line failed
+        with. Lines that repeat within the episode are synthesized once and
+        shared.
+    """
+    lines = {}
+    for key, line in jobs.items():
+        lines.setdefault(line, []).append(key)
+    results = await asyncio.gather(*(synthesize(*line) for line in lines),
+                                   return_exceptions=True)
+    audio = {}
+    for keys, result in zip(lines.values(), results):
+        for key in keys:
+            audio[key] = result
+    return audio